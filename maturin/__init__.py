@@ -9,34 +9,48 @@ even though the terminal supports utf8. Writing directly to the binary stdout bu
 maturin's emojis.
 """
 
+import functools
 import os
-import shutil
-import subprocess
 import sys
-from subprocess import SubprocessError
-from typing import List, Dict
-
-import toml
+from typing import List, Dict, Optional, Tuple
 
 # these are only used when creating the sdist, not when building it
-create_only_options = [
-    "sdist-include",
-]
-
-available_options = [
-    "bindings",
-    "cargo-extra-args",
-    "compatibility",
-    "manylinux",
-    "rustc-extra-args",
-    "skip-auditwheel",
-    "strip",
-]
+create_only_options = frozenset(
+    [
+        "sdist-include",
+    ]
+)
+
+available_options = frozenset(
+    [
+        "bindings",
+        "cargo-extra-args",
+        "compatibility",
+        "manylinux",
+        "rustc-extra-args",
+        "skip-auditwheel",
+        "strip",
+    ]
+)
 
 
 def get_config() -> Dict[str, str]:
-    with open("pyproject.toml", encoding="utf-8") as fp:
-        pyproject_toml = toml.load(fp)
+    # pip calls several hooks in a row, so pyproject.toml is only parsed again when it changed
+    path = os.path.abspath("pyproject.toml")
+    return _load_config(path, os.stat(path).st_mtime_ns)
+
+
+# noinspection PyUnusedLocal
+@functools.lru_cache(maxsize=1)
+def _load_config(path: str, mtime_ns: int) -> Dict[str, str]:
+    # Only imported when needed, the hooks that don't read the config shouldn't pay for the parser
+    if sys.version_info >= (3, 11):
+        import tomllib
+    else:
+        import tomli as tomllib
+
+    with open(path, "rb") as fp:
+        pyproject_toml = tomllib.load(fp)
     return pyproject_toml.get("tool", {}).get("maturin", {})
 
 
@@ -49,50 +63,137 @@ def get_config_options() -> List[str]:
         if key not in available_options:
             # attempt to install even if keys from newer or older versions are present
             sys.stderr.write(f"WARNING: {key} is not a recognized option for maturin\n")
-        options.append("--{}={}".format(key, value))
+        options.append(f"--{key}={value}")
     return options
 
 
-# noinspection PyUnusedLocal
-def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
-    # PEP 517 specifies that only `sys.executable` points to the correct
-    # python interpreter
-    command = ["maturin", "pep517", "build-wheel", "-i", sys.executable]
-    command.extend(get_config_options())
+@functools.lru_cache(maxsize=1)
+def _maturin_bin() -> str:
+    """Looks up maturin on PATH once instead of on every subprocess call"""
+    import shutil
+
+    return shutil.which("maturin") or "maturin"
 
-    print("Running `{}`".format(" ".join(command)))
-    sys.stdout.flush()
-    result = subprocess.run(command, stdout=subprocess.PIPE)
-    sys.stdout.buffer.write(result.stdout)
-    sys.stdout.flush()
-    if result.returncode != 0:
+
+def _run_maturin(command: List[str]) -> str:
+    """
+    Runs maturin, forwarding its stdout as it comes in, and returns the last line of stdout
+
+    Only the last line is kept, so we don't hold the whole build log in memory
+    """
+    import subprocess
+
+    stdout = sys.stdout.buffer
+    stdout.write(b"Running `" + " ".join(command).encode(errors="replace") + b"`\n")
+    # maturin's stderr isn't captured, so this needs to be out before maturin starts
+    stdout.flush()
+    last_line = b""
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+        for line in process.stdout:
+            stdout.write(line)
+            stdout.flush()
+            if line.strip():
+                last_line = line
+    if process.returncode != 0:
         sys.stderr.write(
-            f"Error: command {command} returned non-zero exit status {result.returncode}\n"
+            f"Error: command {command} returned non-zero exit status {process.returncode}\n"
         )
+        _check_cargo_installed()
         sys.exit(1)
-    output = result.stdout.decode(errors="replace")
-    wheel_path = output.strip().splitlines()[-1]
+    return last_line.decode(errors="replace").strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _pep517_command(subcommand: str) -> Tuple[str, ...]:
+    """The start of a `maturin pep517` invocation doesn't change within a process, so it's only assembled once"""
+    return _maturin_bin(), "pep517", subcommand
+
+
+def _build_wheel(out: str) -> str:
+    """Runs `maturin pep517 build-wheel` and returns the path of the wheel it built in `out`"""
+    command = [
+        *_pep517_command("build-wheel"),
+        # PEP 517 specifies that only `sys.executable` points to the correct
+        # python interpreter
+        "-i",
+        sys.executable,
+        # Let maturin write the wheel where it's needed instead of moving it there afterwards
+        "--out",
+        out,
+    ]
+    command.extend(get_config_options())
+    return _run_maturin(command)
+
+
+def _find_prebuilt_wheel(metadata_directory: str) -> Optional[str]:
+    """Returns the wheel that prepare_metadata_for_build_wheel has built next to the given .dist-info, if any"""
+    metadata_directory = os.path.normpath(metadata_directory)
+    dist_info_name = os.path.basename(metadata_directory)
+    if not dist_info_name.endswith(".dist-info"):
+        return None
+    prefix = dist_info_name[: -len(".dist-info")] + "-"
+    parent = os.path.dirname(metadata_directory)
+    for filename in os.listdir(parent):
+        if filename.startswith(prefix) and filename.endswith(".whl"):
+            return os.path.join(parent, filename)
+    return None
+
+
+def _check_cargo_installed():
+    """
+    Explains a failed maturin invocation if it was caused by a missing rust toolchain
+
+    This is only checked after maturin failed so the common case doesn't pay for it
+    """
+    import shutil
+
+    if shutil.which("cargo") is None:
+        sys.stderr.write(
+            "\nCargo, the Rust package manager, is not installed or is not on PATH.\n"
+            "This package requires Rust and Cargo to compile extensions. Install it through\n"
+            "the system's package manager or via https://rustup.rs/\n\n"
+        )
+
+
+def _stage_wheel(wheel_path: str, target: str):
+    """
+    Moves a wheel maturin built to where the frontend expects it
+
+    Renaming or hardlinking avoids copying the whole wheel when both paths are on the same filesystem
+    """
+    try:
+        os.rename(wheel_path, target)
+        return
+    except OSError:
+        pass
+    try:
+        os.link(wheel_path, target)
+        return
+    except OSError:
+        pass
+    import shutil
+
+    shutil.copy2(wheel_path, target)
+
+
+# noinspection PyUnusedLocal
+def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
+    wheel_path = None
+    if metadata_directory is not None:
+        wheel_path = _find_prebuilt_wheel(metadata_directory)
+    if wheel_path is None:
+        wheel_path = _build_wheel(wheel_directory)
     filename = os.path.basename(wheel_path)
-    shutil.copy2(wheel_path, os.path.join(wheel_directory, filename))
+    target = os.path.join(wheel_directory, filename)
+    if os.path.abspath(wheel_path) != os.path.abspath(target):
+        _stage_wheel(wheel_path, target)
     return filename
 
 
 # noinspection PyUnusedLocal
 def build_sdist(sdist_directory, config_settings=None):
-    command = ["maturin", "pep517", "write-sdist", "--sdist-directory", sdist_directory]
-
-    print("Running `{}`".format(" ".join(command)))
-    sys.stdout.flush()
-    result = subprocess.run(command, stdout=subprocess.PIPE)
-    sys.stdout.buffer.write(result.stdout)
-    sys.stdout.flush()
-    if result.returncode != 0:
-        sys.stderr.write(
-            f"Error: command {command} returned non-zero exit status {result.returncode}\n"
-        )
-        sys.exit(1)
-    output = result.stdout.decode(errors="replace")
-    return output.strip().splitlines()[-1]
+    command = [*_pep517_command("write-sdist"), "--sdist-directory", sdist_directory]
+    return _run_maturin(command)
 
 
 # noinspection PyUnusedLocal
@@ -108,31 +209,31 @@ def get_requires_for_build_sdist(config_settings=None):
     return []
 
 
+def _prepare_metadata_from_wheel(metadata_directory: str) -> str:
+    """
+    Builds the whole wheel and extracts its .dist-info, so that build_wheel can reuse the wheel
+    instead of invoking maturin a second time
+    """
+    import zipfile
+
+    wheel_path = _build_wheel(metadata_directory)
+    with zipfile.ZipFile(wheel_path) as wheel:
+        dist_info = [
+            name
+            for name in wheel.namelist()
+            if name.split("/")[0].endswith(".dist-info")
+        ]
+        wheel.extractall(metadata_directory, dist_info)
+    return dist_info[0].split("/")[0]
+
+
 # noinspection PyUnusedLocal
 def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):
-    print("Checking for Rust toolchain....")
-    is_cargo_installed = False
-    try:
-        output = subprocess.check_output(["cargo", "--version"]).decode(
-            "utf-8", "ignore"
-        )
-        if "cargo" in output:
-            is_cargo_installed = True
-    except (FileNotFoundError, SubprocessError):
-        pass
-
-    if not is_cargo_installed:
-        sys.stderr.write(
-            "\nCargo, the Rust package manager, is not installed or is not on PATH.\n"
-            "This package requires Rust and Cargo to compile extensions. Install it through\n"
-            "the system's package manager or via https://rustup.rs/\n\n"
-        )
-        sys.exit(1)
+    if os.environ.get("MATURIN_PEP517_PREBUILD_WHEEL"):
+        return _prepare_metadata_from_wheel(metadata_directory)
 
     command = [
-        "maturin",
-        "pep517",
-        "write-dist-info",
+        *_pep517_command("write-dist-info"),
         "--metadata-directory",
         metadata_directory,
         # PEP 517 specifies that only `sys.executable` points to the correct
@@ -142,13 +243,4 @@ def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):
     ]
     command.extend(get_config_options())
 
-    print("Running `{}`".format(" ".join(command)))
-    try:
-        output = subprocess.check_output(command)
-    except subprocess.CalledProcessError as e:
-        sys.stderr.write(f"Error running maturin: {e}\n")
-        sys.exit(1)
-    sys.stdout.buffer.write(output)
-    sys.stdout.flush()
-    output = output.decode(errors="replace")
-    return output.strip().splitlines()[-1]
+    return _run_maturin(command)